@@ -23,7 +23,7 @@ the name tree and related operations to manage it.
 """
 
 import bisect
-import threading
+import itertools
 import logging
 import time
 from pyndn import Name, Interest, Data, MetaInfo
@@ -44,42 +44,98 @@ class Namespace(object):
     :param KeyChain keyChain: (optional) The KeyChain for signing packets,
       if needed. You can also call setKeyChain().
     """
+    # A large name tree has a Namespace object for every node, so use slots
+    # instead of a per-object __dict__. Keep __weakref__ so that the
+    # application can still make weak references to Namespace objects.
+    __slots__ = (
+      '_name', '_depth', '_parent', '_root', '_children',
+      '_sortedChildrenKeys', '_unsortedChildrenKeys', '_state',
+      '_networkNack', '_validateState', '_validationError',
+      '_freshnessExpiryTimeMilliseconds', '_data', '_nSubtreeData',
+      '_maxSubtreeDataDepth', '_object', '_face', '_configVersion',
+      '_cachedFace', '_keyChain', '_cachedKeyChain', '_newDataMetaInfo',
+      '_cachedNewDataMetaInfo', '_decryptor', '_cachedDecryptor',
+      '_decryptionError', '_signingError', '_onStateChangedCallbacks',
+      '_onValidateStateChangedCallbacks', '_nOnStateChangedCallbacks',
+      '_nOnValidateStateChangedCallbacks', '_nOnObjectNeededCallbacks',
+      '_onObjectNeededCallbacks', '_onDeserializeNeededCallbacks',
+      '_pendingIncomingInterestTable', '_fullPSync', '_maxInterestLifetime',
+      '_cachedMaxInterestLifetime', '_syncDepth', '__weakref__')
+
     def __init__(self, name, keyChain = None):
         self._name = Name(name)
+        # The number of components in _name, so that loops over the tree don't
+        # need to call _name.size(). This is updated by _createChild.
+        self._depth = self._name.size()
         # _parent and _root may be updated by _createChild.
         self._parent = None
         self._root = self
         # The dictionary key is a Name.Component. The value is the child Namespace.
-        self._children = {}
-        # The keys of _children in sorted order, kept in sync with _children.
-        # (We don't use OrderedDict because it doesn't sort keys on insert.)
-        self._sortedChildrenKeys = []
+        # Most nodes in a large tree are leaves, so this is None until
+        # _createChild adds the first child.
+        self._children = None
+        # The keys of _children in sorted order. Instead of keeping this in
+        # sync on every insert, _createChild adds the key to
+        # _unsortedChildrenKeys and _getSortedChildrenKeys merges them when the
+        # sorted keys are needed. This is None until they are first needed.
+        self._sortedChildrenKeys = None
+        # The keys added by _createChild since _sortedChildrenKeys was updated,
+        # or None if there are none.
+        self._unsortedChildrenKeys = None
         self._state = NamespaceState.NAME_EXISTS
         self._networkNack = None
         self._validateState = NamespaceValidateState.WAITING_FOR_DATA
         self._validationError = None
         self._freshnessExpiryTimeMilliseconds = None
         self._data = None
+        # The number of nodes in the subtree at this node (including this node)
+        # which have a Data packet. _findBestMatchName skips a subtree if zero.
+        self._nSubtreeData = 0
+        # The greatest _depth of a node with a Data packet in the subtree. This
+        # is only meaningful if _nSubtreeData > 0.
+        self._maxSubtreeDataDepth = 0
         self._object = None
+        # In the root Namespace node, setFace, setKeyChain, setDecryptor,
+        # setMaxInterestLifetime and setNewDataMetaInfo increment this so that
+        # each node's cached results of _getFace, etc. are recomputed.
+        self._configVersion = 0
+        # Each _cachedX is the (configVersion, x) from the last call to _getX,
+        # or None.
         self._face = None
+        self._cachedFace = None
         self._keyChain = keyChain
+        self._cachedKeyChain = None
         self._newDataMetaInfo = None
+        self._cachedNewDataMetaInfo = None
         self._decryptor = None
+        self._cachedDecryptor = None
         self._decryptionError = ""
         self._signingError = ""
+        # Most nodes never get callbacks, so each of the following callback
+        # dictionaries is None until the first callback of its type is added.
         # The dictionary key is the callback ID. The value is the onStateChanged function.
-        self._onStateChangedCallbacks = {}
+        self._onStateChangedCallbacks = None
         # The dictionary key is the callback ID. The value is the onValidateStateChanged function.
-        self._onValidateStateChangedCallbacks = {}
+        self._onValidateStateChangedCallbacks = None
+        # In the root Namespace node, the number of onStateChanged and
+        # onValidateStateChanged callbacks in the whole tree. If zero, then
+        # _setState and _setValidateState don't need to check the parents.
+        self._nOnStateChangedCallbacks = 0
+        self._nOnValidateStateChangedCallbacks = 0
+        # In the root Namespace node, the number of onObjectNeeded callbacks in
+        # the whole tree. If zero, then objectNeeded and _onInterest don't need
+        # to check the parents.
+        self._nOnObjectNeededCallbacks = 0
         # The dictionary key is the callback ID. The value is the onObjectNeeded function.
-        self._onObjectNeededCallbacks = {}
+        self._onObjectNeededCallbacks = None
         # The dictionary key is the callback ID. The value is the onDeserializetNeeded function.
-        self._onDeserializeNeededCallbacks = {}
+        self._onDeserializeNeededCallbacks = None
         # setFace will create this in the root Namespace node.
         self._pendingIncomingInterestTable = None
         # This will be created in the root Namespace node.
         self._fullPSync = None
         self._maxInterestLifetime = None
+        self._cachedMaxInterestLifetime = None
         self._syncDepth = -1
 
     class Handler(object):
@@ -250,29 +306,25 @@ class Namespace(object):
                 raise RuntimeError(
                   "The name of this node is not a prefix of the descendant name")
 
-            if descendantName.size() == self._name.size():
-                # A trivial case where it is already the name of this node.
-                return True
-
             # Find the child node whose name equals the descendantName.
             # We know descendantNamespace is a prefix, so we can just go by
-            # component count instead of a full compare.
+            # component count instead of a full compare. (If the descendantName
+            # is the name of this node, the loop is skipped and we return True.)
             descendantNamespace = self
-            while True:
-                nextComponent = descendantName[descendantNamespace._name.size()]
-                if not (nextComponent in descendantNamespace._children):
+            for i in range(self._depth, descendantName.size()):
+                children = descendantNamespace._children
+                if children == None:
                     return False
 
-                if descendantNamespace._name.size() + 1 == descendantName.size():
-                    # nextComponent is the final component.
-                    return True
-                descendantNamespace = descendantNamespace._children[nextComponent]
-        else:
-            component = nameOrComponent
-            if not isinstance(component, Name.Component):
-                component = Name.Component(component)
+                # Use get() instead of "in" then [] to only hash once.
+                descendantNamespace = children.get(descendantName[i])
+                if descendantNamespace == None:
+                    return False
 
-            return component in self._children
+            return True
+        else:
+            component = Namespace._toComponent(nameOrComponent)
+            return self._children != None and component in self._children
 
     def getChild(self, nameOrComponent):
         """
@@ -298,31 +350,147 @@ class Namespace(object):
                 raise RuntimeError(
                   "The name of this node is not a prefix of the descendant name")
 
-            # Find or create the child node whose name equals the descendantName.
-            # We know descendantNamespace is a prefix, so we can just go by
-            # component count instead of a full compare.
-            descendantNamespace = self
-            while descendantNamespace._name.size() < descendantName.size():
-                nextComponent = descendantName[descendantNamespace._name.size()]
-                if nextComponent in descendantNamespace._children:
-                    descendantNamespace = descendantNamespace._children[nextComponent]
-                else:
-                    # Only fire the callbacks for the leaf node.
-                    isLeaf = (
-                      descendantNamespace._name.size() == descendantName.size() - 1)
-                    descendantNamespace = descendantNamespace._createChild(
-                      nextComponent, isLeaf)
-
-            return descendantNamespace
+            return self._getDescendant(descendantName)
         else:
-            component = nameOrComponent
-            if not isinstance(component, Name.Component):
-                component = Name.Component(component)
+            return self._getChild(Namespace._toComponent(nameOrComponent))
 
-            if component in self._children:
-                return self._children[component]
+    @staticmethod
+    def _toComponent(value):
+        """
+        Get the Name.Component for the value given to hasChild or getChild. If
+        value is a str or bytes, reuse a Name.Component made from an earlier
+        call with the same value instead of constructing a new one.
+
+        :param value: The Name.Component, or the value for the Name.Component
+          constructor.
+        :return: The Name.Component.
+        :rtype: Name.Component
+        """
+        if isinstance(value, Name.Component):
+            return value
+        if not (type(value) is str or type(value) is bytes):
+            # The value may not be hashable, so don't cache it.
+            return Name.Component(value)
+
+        component = Namespace._componentCache.get(value)
+        if component == None:
+            if len(Namespace._componentCache) >= Namespace._maxComponentCacheSize:
+                # Simply start over instead of tracking the least recently used.
+                Namespace._componentCache.clear()
+            component = Name.Component(value)
+            Namespace._componentCache[value] = component
+
+        return component
+
+    def _getChild(self, component):
+        """
+        Get the immediate child with the component, creating it if needed. This
+        is the same as getChild(component) but skips the type check, so the
+        caller must already have a Name.Component. This is an internal method
+        only meant to be called by library classes; the application should not
+        call it.
+
+        :param Name.Component component: The name component of the child.
+        :return: The child Namespace object.
+        :rtype: Namespace
+        """
+        if self._children != None:
+            # Use get() instead of "in" then [] to only hash once.
+            child = self._children.get(component)
+            if child != None:
+                return child
+
+        return self._createChild(component, True)
+
+    def getChildren(self, names):
+        """
+        Get the descendant nodes with the given names, creating them if needed.
+        This is equivalent to calling getChild(name) for each name, but when
+        consecutive names share a prefix (for example, the segment names of one
+        object) this only descends through the shared prefix once.
+
+        :param names: The names of the descendants, each of which must have this
+          node's name as a prefix.
+        :type names: list of Name
+        :return: A list of the descendant Namespace objects in the same order as
+          names.
+        :rtype: list of Namespace
+        :raises RuntimeError: If the name of this Namespace node is not a prefix
+          of one of the names.
+        """
+        result = []
+        previousName = None
+        previousNamespace = None
+        for name in names:
+            # Get the number of components shared with the previous name. Names
+            # made from the same prefix share component objects, so first try
+            # the fast "is" check.
+            nShared = 0
+            if previousName != None:
+                maxShared = min(name.size(), previousName.size())
+                while nShared < maxShared:
+                    component = name[nShared]
+                    previousComponent = previousName[nShared]
+                    if not (component is previousComponent or
+                            component == previousComponent):
+                        break
+                    nShared += 1
+
+            if previousNamespace != None and nShared >= self._depth:
+                # The previous name has this node's name as a prefix, so this
+                # name does too. Start from the deepest shared ancestor.
+                namespace = previousNamespace
+                for i in range(previousNamespace._depth - nShared):
+                    namespace = namespace._parent
+            else:
+                if not self._name.isPrefixOf(name):
+                    raise RuntimeError(
+                      "The name of this node is not a prefix of the descendant name")
+                namespace = self
+
+            previousNamespace = namespace._getDescendant(name)
+            previousName = name
+            result.append(previousNamespace)
+
+        return result
+
+    def _getDescendant(self, descendantName):
+        """
+        Find or create the descendant node with the given name. This is the
+        same as getChild(descendantName) but does not check that the name of
+        this node is a prefix of descendantName. This private method should
+        only be called if the caller already knows that it is, for example
+        because it already called isPrefixOf or because the name came from a
+        Data packet which matches an Interest for this node. The application
+        should use getChild.
+
+        :param Name descendantName: The name of the descendant, which must have
+          this node's name as a prefix.
+        :return: The descendant Namespace object, or this Namespace if
+          descendantName equals its name.
+        :rtype: Namespace
+        """
+        # Find or create the child node whose name equals the descendantName.
+        # We know descendantNamespace is a prefix, so we can just go by
+        # component count instead of a full compare. Get the sizes once
+        # instead of calling size() on each pass of the loop.
+        descendantNameSize = descendantName.size()
+        descendantNamespace = self
+        for i in range(self._depth, descendantNameSize):
+            nextComponent = descendantName[i]
+            children = descendantNamespace._children
+            # Use get() instead of "in" then [] to only hash once.
+            child = (None if children == None
+                     else children.get(nextComponent))
+            if child != None:
+                descendantNamespace = child
             else:
-                return self._createChild(component, True)
+                # Only fire the callbacks for the leaf node.
+                isLeaf = (i == descendantNameSize - 1)
+                descendantNamespace = descendantNamespace._createChild(
+                  nextComponent, isLeaf)
+
+        return descendantNamespace
 
     def getChildComponents(self):
         """
@@ -332,7 +500,39 @@ class Namespace(object):
           This remains the same if child nodes are added or deleted.
         :rtype: list of Name.Component
         """
-        return self._sortedChildrenKeys[:]
+        sortedChildrenKeys = self._getSortedChildrenKeys()
+        if sortedChildrenKeys == None:
+            return []
+        return sortedChildrenKeys[:]
+
+    def _getSortedChildrenKeys(self):
+        """
+        Get the keys of _children in sorted order. If children were added since
+        the last call, update _sortedChildrenKeys. The first time, this sorts
+        all the keys. After that, this only inserts the keys that were added,
+        so that alternately adding a child and getting the sorted keys (as a
+        segment fetcher does) doesn't sort all the keys each time.
+
+        :return: The sorted list of child name components, or None if there are
+          no children. The caller must not modify the list.
+        :rtype: list of Name.Component
+        """
+        if self._sortedChildrenKeys == None:
+            if self._children != None:
+                self._sortedChildrenKeys = sorted(self._children)
+        elif self._unsortedChildrenKeys != None:
+            sortedChildrenKeys = self._sortedChildrenKeys
+            for component in self._unsortedChildrenKeys:
+                if (len(sortedChildrenKeys) == 0 or
+                    sortedChildrenKeys[-1] < component):
+                    # Children such as segments are usually added in order, so
+                    # append without searching or shifting the list.
+                    sortedChildrenKeys.append(component)
+                else:
+                    bisect.insort(sortedChildrenKeys, component)
+            self._unsortedChildrenKeys = None
+
+        return self._sortedChildrenKeys
 
     def serializeObject(self, obj):
         # TODO: What if this node already has a _data and/or _object?
@@ -369,8 +569,9 @@ class Namespace(object):
             self._setState(NamespaceState.SIGNING_ERROR)
             return
 
-        # This calls satisfyInterests.
-        self.setData(data)
+        # This calls satisfyInterests. The Data name is this node's name, so
+        # skip the check in setData.
+        self._setData(data)
 
         self._setObject(obj)
 
@@ -402,21 +603,70 @@ class Namespace(object):
             raise RuntimeError(
               "The Data packet name does not equal the name of this Namespace node.")
 
+        return self._setData(data)
+
+    def _setData(self, data):
+        """
+        This is the same as setData but does not check that the Data packet name
+        equals the name of this Namespace node. This is called internally where
+        this node was found from the Data packet name, so the names are already
+        known to be equal.
+
+        :param Data data: The Data packet object.
+        :return: True if the Data packet is attached, False if a Data packet was
+          already attached.
+        :rtype: bool
+        """
+        if self._data != None:
+            # We already have an attached object.
+            return False
+
         if self._root._pendingIncomingInterestTable != None:
             # Quickly send the Data packet to satisfy interests, before calling callbacks.
             self._root._pendingIncomingInterestTable.satisfyInterests(data)
 
-        if (data.getMetaInfo().getFreshnessPeriod() != None and
-            data.getMetaInfo().getFreshnessPeriod() >= 0.0):
+        freshnessPeriod = data.getMetaInfo().getFreshnessPeriod()
+        if freshnessPeriod != None and freshnessPeriod >= 0.0:
             self._freshnessExpiryTimeMilliseconds = (Common.getNowMilliseconds() +
-              data.getMetaInfo().getFreshnessPeriod())
+              freshnessPeriod)
         else:
             # Does not expire.
             self._freshnessExpiryTimeMilliseconds = None
         self._data = data
+        namespace = self
+        while namespace != None:
+            namespace._nSubtreeData += 1
+            if self._depth > namespace._maxSubtreeDataDepth:
+                namespace._maxSubtreeDataDepth = self._depth
+            namespace = namespace._parent
 
         return True
 
+    def setDataBatch(self, dataList):
+        """
+        Attach each Data packet to the descendant Namespace node with its name,
+        creating the node if needed, as described by setData. This is equivalent
+        to calling getChild(data.getName()).setData(data) for each Data packet,
+        but when consecutive Data packets share a name prefix (for example, the
+        segments of one object) this only descends through the shared prefix
+        once. See getChildren.
+
+        :param dataList: The Data packets, each of whose name must have this
+          node's name as a prefix. For efficiency, this does not copy the Data
+          packet objects.
+        :type dataList: list of Data
+        :return: A list of the results of setData in the same order as
+          dataList, where each is True if the Data packet is attached, False if
+          a Data packet was already attached.
+        :rtype: list of bool
+        :raises RuntimeError: If the name of this Namespace node is not a prefix
+          of one of the Data packet names.
+        """
+        dataNamespaces = self.getChildren([data.name for data in dataList])
+        # Each Namespace was found from the Data name, so skip the check in setData.
+        return [dataNamespace._setData(data)
+                for dataNamespace, data in zip(dataNamespaces, dataList)]
+
     def getData(self):
         """
         Get the Data packet attached to this Namespace object. Note that
@@ -437,19 +687,44 @@ class Namespace(object):
 
     def getAllData(self, dataList):
         """
-        Recursively append to the Data packets for this and children nodes to
-        the given list.
+        Append to the given list the Data packets for this and children nodes,
+        in the same order as iterAllData.
 
         :param Array<Data> dataList: Append the Data packets to this list. This
           does not first clear the list. You should not modify the returned Data
           packets. If you need to modify one, then make a copy.
         """
-        if self._data != None:
-            dataList.append(self._data)
+        dataList.extend(self.iterAllData())
 
-        if len(self._children) > 0:
-            for child in self._sortedChildrenKeys:
-                self._children[child].getAllData(dataList)
+    def iterAllData(self):
+        """
+        Get a generator of the Data packets for this and children nodes. This
+        node's Data packet comes first, then the Data packets of each child
+        subtree in the order of getChildComponents(). This is the same as
+        getAllData but does not build a list.
+
+        :return: A generator of Data. You should not modify the returned Data
+          packets. If you need to modify one, then make a copy.
+        :rtype: generator
+        """
+        if self._nSubtreeData == 0:
+            return
+
+        # Use an explicit stack instead of recursion. Skip subtrees with no Data.
+        stack = [self]
+        while len(stack) > 0:
+            namespace = stack.pop()
+            if namespace._data != None:
+                yield namespace._data
+
+            if namespace._children != None:
+                # Push the children backwards so that they are popped in order.
+                children = namespace._children
+                sortedChildrenKeys = namespace._getSortedChildrenKeys()
+                for i in range(len(sortedChildrenKeys) - 1, -1, -1):
+                    child = children[sortedChildrenKeys[i]]
+                    if child._nSubtreeData > 0:
+                        stack.append(child)
 
     def getObject(self):
         """
@@ -489,8 +764,11 @@ class Namespace(object):
         :return: The callback ID which you can use in removeCallback().
         :rtype: int
         """
-        callbackId = Namespace.getNextCallbackId()
+        callbackId = next(Namespace._callbackIdCounter)
+        if self._onStateChangedCallbacks == None:
+            self._onStateChangedCallbacks = {}
         self._onStateChangedCallbacks[callbackId] = onStateChanged
+        self._root._nOnStateChangedCallbacks += 1
         return callbackId
 
     def addOnValidateStateChanged(self, onValidateStateChanged):
@@ -518,8 +796,11 @@ class Namespace(object):
         :return: The callback ID which you can use in removeCallback().
         :rtype: int
         """
-        callbackId = Namespace.getNextCallbackId()
+        callbackId = next(Namespace._callbackIdCounter)
+        if self._onValidateStateChangedCallbacks == None:
+            self._onValidateStateChangedCallbacks = {}
         self._onValidateStateChangedCallbacks[callbackId] = onValidateStateChanged
+        self._root._nOnValidateStateChangedCallbacks += 1
         return callbackId
 
     def addOnObjectNeeded(self, onObjectNeeded):
@@ -545,8 +826,11 @@ class Namespace(object):
         :return: The callback ID which you can use in removeCallback().
         :rtype: int
         """
-        callbackId = Namespace.getNextCallbackId()
+        callbackId = next(Namespace._callbackIdCounter)
+        if self._onObjectNeededCallbacks == None:
+            self._onObjectNeededCallbacks = {}
         self._onObjectNeededCallbacks[callbackId] = onObjectNeeded
+        self._root._nOnObjectNeededCallbacks += 1
         return callbackId
 
     def removeCallback(self, callbackId):
@@ -557,8 +841,21 @@ class Namespace(object):
         :param int callbackId: The callback ID returned, for example, from
           addOnStateChanged.
         """
-        self._onStateChangedCallbacks.pop(callbackId, None)
-        self._onValidateStateChangedCallbacks.pop(callbackId, None)
+        # Callback IDs are unique, so stop at the first dictionary which has it.
+        if (self._onStateChangedCallbacks != None and
+            self._onStateChangedCallbacks.pop(callbackId, None) != None):
+            self._root._nOnStateChangedCallbacks -= 1
+            return
+        if (self._onValidateStateChangedCallbacks != None and
+            self._onValidateStateChangedCallbacks.pop(callbackId, None) != None):
+            self._root._nOnValidateStateChangedCallbacks -= 1
+            return
+        if (self._onObjectNeededCallbacks != None and
+            self._onObjectNeededCallbacks.pop(callbackId, None) != None):
+            self._root._nOnObjectNeededCallbacks -= 1
+            return
+        if self._onDeserializeNeededCallbacks != None:
+            self._onDeserializeNeededCallbacks.pop(callbackId, None)
 
     def setFace(self, face, onRegisterFailed = None, onRegisterSuccess = None):
         """
@@ -590,6 +887,7 @@ class Namespace(object):
           handle any exceptions.
         """
         self._face = face
+        self._root._configVersion += 1
 
         if onRegisterFailed != None:
             if self._root._pendingIncomingInterestTable == None:
@@ -609,6 +907,7 @@ class Namespace(object):
         :param KeyChain keyChain: The KeyChain.
         """
         self._keyChain = keyChain
+        self._root._configVersion += 1
 
     def enableSync(self, depth = 30000):
         """
@@ -641,13 +940,7 @@ class Namespace(object):
         :return: The KeyChain, or None if not set on this or any parent.
         :rtype: KeyChain
         """
-        namespace = self
-        while namespace != None:
-            if namespace._keyChain != None:
-                return namespace._keyChain
-            namespace = namespace._parent
-
-        return None
+        return self._getInherited('_keyChain', '_cachedKeyChain', None)
 
     def _getSyncNode(self):
         """
@@ -672,6 +965,7 @@ class Namespace(object):
         :param MetaInfo metaInfo: The MetaInfo object, which is copied.
         """
         self._newDataMetaInfo = MetaInfo(metaInfo)
+        self._root._configVersion += 1
 
     def setDecryptor(self, decryptor):
         """
@@ -682,6 +976,7 @@ class Namespace(object):
         :param DecryptorV2 decryptor: The decryptor.
         """
         self._decryptor = decryptor
+        self._root._configVersion += 1
 
     def objectNeeded(self, mustBeFresh = False):
         """
@@ -705,13 +1000,16 @@ class Namespace(object):
             bestMatch._setState(NamespaceState.OBJECT_READY)
             return
 
-        # Ask all OnObjectNeeded callbacks if they can produce.
+        # Ask all OnObjectNeeded callbacks if they can produce. Skip the parents
+        # if there are no callbacks in the tree, and skip nodes without them.
         canProduce = False
-        namespace = self
-        while namespace != None:
-            if namespace._fireOnObjectNeeded(self):
-                canProduce = True
-            namespace = namespace._parent
+        if self._root._nOnObjectNeededCallbacks > 0:
+            namespace = self
+            while namespace != None:
+                if (namespace._onObjectNeededCallbacks and
+                    namespace._fireOnObjectNeeded(self)):
+                    canProduce = True
+                namespace = namespace._parent
 
         # Debug: Check if the object has been set (even if onObjectNeeded returned False.)
 
@@ -750,6 +1048,7 @@ class Namespace(object):
           milliseconds.
         """
         self._maxInterestLifetime = maxInterestLifetime
+        self._root._configVersion += 1
 
     def _getFace(self):
         """
@@ -760,13 +1059,7 @@ class Namespace(object):
         :return: The Face, or None if not set on this or any parent.
         :rtype: Face
         """
-        namespace = self
-        while namespace != None:
-            if namespace._face != None:
-                return namespace._face
-            namespace = namespace._parent
-
-        return None
+        return self._getInherited('_face', '_cachedFace', None)
 
     def _getDecryptor(self):
         """
@@ -775,13 +1068,7 @@ class Namespace(object):
         :return: The decryptor, or None if not set on this or any parent.
         :rtype: DecryptorV2
         """
-        namespace = self
-        while namespace != None:
-            if namespace._decryptor != None:
-                return namespace._decryptor
-            namespace = namespace._parent
-
-        return None
+        return self._getInherited('_decryptor', '_cachedDecryptor', None)
 
     def _getMaxInterestLifetime(self):
         """
@@ -791,14 +1078,8 @@ class Namespace(object):
           this or any parent.
         :rtype: float
         """
-        namespace = self
-        while namespace != None:
-            if namespace._maxInterestLifetime != None:
-                return namespace._maxInterestLifetime
-            namespace = namespace._parent
-
-        # Return the default.
-        return 16000.0
+        return self._getInherited(
+          '_maxInterestLifetime', '_cachedMaxInterestLifetime', 16000.0)
 
     def _getNewDataMetaInfo(self):
         """
@@ -807,13 +1088,49 @@ class Namespace(object):
         :return: The new data MetaInfo, or null if not set on this or any parent.
         :rtype: MetaInfo
         """
+        return self._getInherited(
+          '_newDataMetaInfo', '_cachedNewDataMetaInfo', None)
+
+    def _getInherited(self, valueName, cacheName, defaultValue):
+        """
+        Get the value of the attribute valueName that was set on this or a
+        parent node, for _getFace, _getKeyChain, etc. Search up to the node
+        where it is set, or to a node with a valid cached result. Then cache the
+        result in the attribute cacheName of each node on the way so that
+        lookups from their other descendants stop there. A cached result is
+        valid until a setter is called again.
+
+        :param str valueName: The name of the attribute with the value set on a
+          node, such as "_face".
+        :param str cacheName: The name of the attribute with the cached
+          (configVersion, value), such as "_cachedFace".
+        :param defaultValue: The value to return if not set on this or any
+          parent.
+        :return: The value, or defaultValue if not set on this or any parent.
+        """
+        configVersion = self._root._configVersion
+        cached = getattr(self, cacheName)
+        if cached != None and cached[0] == configVersion:
+            return cached[1]
+
+        value = defaultValue
+        visited = []
         namespace = self
         while namespace != None:
-            if namespace._newDataMetaInfo != None:
-                return namespace._newDataMetaInfo
+            if getattr(namespace, valueName) != None:
+                value = getattr(namespace, valueName)
+                break
+            cached = getattr(namespace, cacheName)
+            if cached != None and cached[0] == configVersion:
+                value = cached[1]
+                break
+            visited.append(namespace)
             namespace = namespace._parent
 
-        return None
+        cached = (configVersion, value)
+        for namespace in visited:
+            setattr(namespace, cacheName, cached)
+        return value
 
     def _addOnDeserializeNeeded(self, onDeserializeNeeded):
         """
@@ -836,7 +1153,9 @@ class Namespace(object):
         :return: The callback ID which you can use in removeCallback().
         :rtype: int
         """
-        callbackId = Namespace.getNextCallbackId()
+        callbackId = next(Namespace._callbackIdCounter)
+        if self._onDeserializeNeededCallbacks == None:
+            self._onDeserializeNeededCallbacks = {}
         self._onDeserializeNeededCallbacks[callbackId] = onDeserializeNeeded
         return callbackId
 
@@ -892,13 +1211,23 @@ class Namespace(object):
         :return: The child Namespace object.
         :rtype: Namespace
         """
-        child = Namespace(Name(self._name).append(component))
+        # The constructor copies the name, so append to the child's own copy
+        # instead of making another copy of this name first.
+        child = Namespace(self._name)
+        child._name.append(component)
+        child._depth = self._depth + 1
         child._parent = self
         child._root = self._root
+        if self._children == None:
+            self._children = {}
         self._children[component] = child
 
-        # Keep _sortedChildrenKeys synced with _children.
-        bisect.insort(self._sortedChildrenKeys, component)
+        # Update _sortedChildrenKeys only when it is needed. (If it was never
+        # needed, _getSortedChildrenKeys will sort all the keys at once.)
+        if self._sortedChildrenKeys != None:
+            if self._unsortedChildrenKeys == None:
+                self._unsortedChildrenKeys = []
+            self._unsortedChildrenKeys.append(component)
 
         if fireCallbacks:
             child._setState(NamespaceState.NAME_EXISTS)
@@ -908,7 +1237,7 @@ class Namespace(object):
                 syncNode = child._getSyncNode()
                 if syncNode != None:
                     # Only sync names to the specified depth.
-                    depth = child._name.size() - syncNode._name.size()
+                    depth = child._depth - syncNode._depth
 
                     if depth <= syncNode._syncDepth:
                         # If _createChild is called when onNamesUpdate receives
@@ -927,21 +1256,27 @@ class Namespace(object):
         :param int state: The new state as an int from the NamespaceState enum.
         """
         self._state = state
+        if self._root._nOnStateChangedCallbacks == 0:
+            # There are no callbacks in the tree, so don't check the parents.
+            return
 
-        # Fire callbacks.
+        # Fire callbacks. Only call _fireOnStateChanged on nodes which have
+        # callbacks, since most ancestors don't.
         namespace = self
         while namespace != None:
-            namespace._fireOnStateChanged(self, state)
+            if namespace._onStateChangedCallbacks:
+                namespace._fireOnStateChanged(self, state)
             namespace = namespace._parent
 
     def _fireOnStateChanged(self, changedNamespace, state):
-        # Copy the keys before iterating since callbacks can change the list.
-        for id in list(self._onStateChangedCallbacks.keys()):
+        # _setState only calls this if there are callbacks.
+        callbacks = self._onStateChangedCallbacks
+        # Copy the items before iterating since callbacks can change the list.
+        for id, onStateChanged in list(callbacks.items()):
             # A callback on a previous pass may have removed this callback, so check.
-            if id in self._onStateChangedCallbacks:
+            if id in callbacks:
                 try:
-                    self._onStateChangedCallbacks[id](
-                      self, changedNamespace, state, id)
+                    onStateChanged(self, changedNamespace, state, id)
                 except:
                     logging.exception("Error in onStateChanged")
 
@@ -956,32 +1291,42 @@ class Namespace(object):
           NamespaceValidateState enum.
         """
         self._validateState = validateState
+        if self._root._nOnValidateStateChangedCallbacks == 0:
+            # There are no callbacks in the tree, so don't check the parents.
+            return
 
-        # Fire callbacks.
+        # Fire callbacks. Only call _fireOnValidateStateChanged on nodes which
+        # have callbacks, since most ancestors don't.
         namespace = self
         while namespace != None:
-            namespace._fireOnValidateStateChanged(self, validateState)
+            if namespace._onValidateStateChangedCallbacks:
+                namespace._fireOnValidateStateChanged(self, validateState)
             namespace = namespace._parent
 
     def _fireOnValidateStateChanged(self, changedNamespace, validateState):
-        # Copy the keys before iterating since callbacks can change the list.
-        for id in list(self._onValidateStateChangedCallbacks.keys()):
+        # _setValidateState only calls this if there are callbacks.
+        callbacks = self._onValidateStateChangedCallbacks
+        # Copy the items before iterating since callbacks can change the list.
+        for id, onValidateStateChanged in list(callbacks.items()):
             # A callback on a previous pass may have removed this callback, so check.
-            if id in self._onValidateStateChangedCallbacks:
+            if id in callbacks:
                 try:
-                    self._onValidateStateChangedCallbacks[id](
+                    onValidateStateChanged(
                       self, changedNamespace, validateState, id)
                 except:
                     logging.exception("Error in onValidateStateChanged")
 
     def _fireOnObjectNeeded(self, neededNamespace):
+        if self._onObjectNeededCallbacks == None:
+            return False
+
         canProduce = False
-        # Copy the keys before iterating since callbacks can change the list.
-        for id in list(self._onObjectNeededCallbacks.keys()):
+        # Copy the items before iterating since callbacks can change the list.
+        for id, onObjectNeeded in list(self._onObjectNeededCallbacks.items()):
             # A callback on a previous pass may have removed this callback, so check.
             if id in self._onObjectNeededCallbacks:
                 try:
-                    if self._onObjectNeededCallbacks[id](self, neededNamespace, id):
+                    if onObjectNeeded(self, neededNamespace, id):
                         canProduce = True
                 except:
                     logging.exception("Error in onObjectNeeded")
@@ -989,15 +1334,18 @@ class Namespace(object):
         return canProduce
 
     def _fireOnDeserializeNeeded(self, blobNamespace, blob, onObjectSet):
+        if self._onDeserializeNeededCallbacks == None:
+            return False
+
         onDeserialized = lambda obj: blobNamespace._defaultOnDeserialized(obj, onObjectSet)
 
-        # Copy the keys before iterating since callbacks can change the list.
-        for id in list(self._onDeserializeNeededCallbacks.keys()):
+        # Copy the items before iterating since callbacks can change the list.
+        for id, onDeserializeNeeded in list(
+              self._onDeserializeNeededCallbacks.items()):
             # A callback on a previous pass may have removed this callback, so check.
             if id in self._onDeserializeNeededCallbacks:
                 try:
-                    if self._onDeserializeNeededCallbacks[
-                      id](blobNamespace, blob, onDeserialized, id):
+                    if onDeserializeNeeded(blobNamespace, blob, onDeserialized, id):
                         return True
                 except:
                     logging.exception("Error in onObjectNeeded")
@@ -1045,26 +1393,31 @@ class Namespace(object):
             # No match.
             return
 
-        # Check if the Namespace node exists and has a matching Data packet.
-        interestNamespace = self.getChild(interestName)
-        if self.hasChild(interestName):
-            bestMatch = Namespace._findBestMatchName(
-              interestNamespace, interest, Common.getNowMilliseconds())
-            if bestMatch != None:
-                # _findBestMatchName makes sure there is a _data packet.
-                face.putData(bestMatch._data)
-                return
+        # Get the Namespace node in one descent and check for a matching Data
+        # packet. We already checked isPrefixOf, so skip the check in getChild.
+        # If the node was just created, its subtree has no Data packet and
+        # _findBestMatchName returns immediately.
+        interestNamespace = self._getDescendant(interestName)
+        bestMatch = Namespace._findBestMatchName(
+          interestNamespace, interest, Common.getNowMilliseconds())
+        if bestMatch != None:
+            # _findBestMatchName makes sure there is a _data packet.
+            face.putData(bestMatch._data)
+            return
 
         # No Data packet found, so save the pending Interest.
         self._root._pendingIncomingInterestTable.add(interest, face)
 
-        # Ask all OnObjectNeeded callbacks if they can produce.
+        # Ask all OnObjectNeeded callbacks if they can produce. Skip the parents
+        # if there are no callbacks in the tree, and skip nodes without them.
         canProduce = False
-        namespace = interestNamespace
-        while namespace != None:
-            if namespace._fireOnObjectNeeded(interestNamespace):
-                canProduce = True
-            namespace = namespace._parent
+        if self._root._nOnObjectNeededCallbacks > 0:
+            namespace = interestNamespace
+            while namespace != None:
+                if (namespace._onObjectNeededCallbacks and
+                    namespace._fireOnObjectNeeded(interestNamespace)):
+                    canProduce = True
+                namespace = namespace._parent
         if canProduce:
             interestNamespace._setState(NamespaceState.PRODUCING_OBJECT)
 
@@ -1082,39 +1435,63 @@ class Namespace(object):
         :rtype: Namespace
         """
         bestMatch = None
-
-        # Search the children backwards which will result in a "less than" name
-        # among names of the same length.
-        for i in range(len(namespace._sortedChildrenKeys) - 1, -1, -1):
-            child = namespace._children[namespace._sortedChildrenKeys[i]]
-            childBestMatch = Namespace._findBestMatchName(
-              child, interest, nowMilliseconds)
-
-            if (childBestMatch != None and
-                (bestMatch == None or
-                 childBestMatch.name.size() >= bestMatch.name.size())):
-                bestMatch = childBestMatch
-
-        if bestMatch != None:
-            # We have a child match, and it is longer than this name, so return it.
-            return bestMatch
-
-        if (interest.getMustBeFresh() and
-            namespace._freshnessExpiryTimeMilliseconds != None and
-            nowMilliseconds >= namespace._freshnessExpiryTimeMilliseconds):
-            # The Data packet is no longer fresh.
-            # Debug: When to set the state to OBJECT_READY_BUT_STALE?
+        mustBeFresh = interest.getMustBeFresh()
+        if namespace._nSubtreeData == 0:
             return None
 
-        if namespace._data != None and interest.matchesData(namespace._data):
-            return namespace
+        # Use an explicit stack instead of recursion. Visit each node before its
+        # children and visit the children in sorted order. A node only replaces
+        # the best match if it is strictly longer, so among matches of the same
+        # length this keeps the "less than" name.
+        stack = [namespace]
+        while len(stack) > 0:
+            node = stack.pop()
+            if (bestMatch != None and
+                node._maxSubtreeDataDepth <= bestMatch._depth):
+                # Nothing in this subtree can be longer than the best match.
+                continue
 
-        return None
+            if (node._data != None and
+                (bestMatch == None or node._depth > bestMatch._depth)):
+                if (mustBeFresh and
+                    node._freshnessExpiryTimeMilliseconds != None and
+                    nowMilliseconds >= node._freshnessExpiryTimeMilliseconds):
+                    # The Data packet is no longer fresh.
+                    # Debug: When to set the state to OBJECT_READY_BUT_STALE?
+                    pass
+                elif interest.matchesData(node._data):
+                    bestMatch = node
+                    if bestMatch._depth == namespace._maxSubtreeDataDepth:
+                        # No other match can be longer.
+                        break
+
+            if node._children != None:
+                # Push the children backwards so that they are popped in order.
+                # Skip children with no Data packet in their subtree.
+                children = node._children
+                sortedChildrenKeys = node._getSortedChildrenKeys()
+                for i in range(len(sortedChildrenKeys) - 1, -1, -1):
+                    child = children[sortedChildrenKeys[i]]
+                    if child._nSubtreeData > 0:
+                        stack.append(child)
+
+        return bestMatch
 
     def _onData(self, interest, data):
         startSeconds = time.clock()
-        dataNamespace = self[data.name]
-        if not dataNamespace.setData(data):
+        if (data.name.size() >= self._depth and
+            not (self._depth > 0 and self._name[-1].isImplicitSha256Digest())):
+            # The Data packet matches the Interest for this node's name, so this
+            # node's name is a prefix and we can skip the check in getChild.
+            # dataNamespace has the Data name, so also skip the check in setData.
+            dataNamespace = self._getDescendant(data.name)
+            isDataSet = dataNamespace._setData(data)
+        else:
+            # This node's name ends in an implicit digest (or is otherwise longer
+            # than the Data name), so it may not be a prefix. Use the checks.
+            dataNamespace = self.getChild(data.name)
+            isDataSet = dataNamespace.setData(data)
+        if not isDataSet:
             # A Data packet is already attached.
             return
         self._setState(NamespaceState.DATA_RECEIVED)
@@ -1152,16 +1529,15 @@ class Namespace(object):
     @staticmethod
     def getNextCallbackId():
         """
-        Get the next unique callback ID. This uses a threading.Lock() to be
-        thread safe. This is an internal method only meant to be called by
-        library classes; the application should not call it.
+        Get the next unique callback ID. This uses itertools.count whose
+        increment is atomic under the GIL, so it is thread safe without a lock.
+        This is an internal method only meant to be called by library classes;
+        the application should not call it.
 
         :return: The next callback ID.
         :rtype: int
         """
-        with Namespace._lastCallbackIdLock:
-            Namespace._lastCallbackId += 1
-            return Namespace._lastCallbackId
+        return next(Namespace._callbackIdCounter)
 
     def _onNamesUpdate(self, names):
         """
@@ -1177,8 +1553,9 @@ class Namespace(object):
                   name.toUri())
                 continue
 
-            # This will create the name if it doesn't exist.
-            self.getChild(name)
+            # This will create the name if it doesn't exist. We already checked
+            # isPrefixOf, so skip the check in getChild.
+            self._getDescendant(name)
 
     name = property(getName)
     parent = property(getParent)
@@ -1193,8 +1570,13 @@ class Namespace(object):
     # object is a special Python term, so use obj .
     obj = property(getObject)
 
-    _lastCallbackId = 0
-    _lastCallbackIdLock = threading.Lock()
+    # getNextCallbackId returns the next value. Methods of this class call
+    # next() on it directly.
+    _callbackIdCounter = itertools.count(1)
+    # The key is a str or bytes value given to hasChild or getChild. The value
+    # is the Name.Component made from it. See _toComponent.
+    _componentCache = {}
+    _maxComponentCacheSize = 1000
 
 class NamespaceState(object):
     """
@@ -23,6 +23,7 @@ Namespace.Handler and attaches to a Namespace node to fetch and return child
 segments in order.
 """
 
+import bisect
 import logging
 from pyndn import Name, Data, DigestSha256Signature
 from pyndn.util import Blob
@@ -43,6 +44,9 @@ class SegmentStreamHandler(Namespace.Handler):
 
         self._maxReportedSegmentNumber = -1
         self._finalSegmentNumber = None
+        # True from when segments are requested until the final segment is
+        # reported or a segment Interest times out or is Nacked.
+        self._isFetching = False
         self._interestPipelineSize = 8
         self._initialInterestCount = 1
         # The dictionary key is the callback ID. The value is the OnSegment function.
@@ -101,15 +105,22 @@ class SegmentStreamHandler(Namespace.Handler):
     def setInterestPipelineSize(self, interestPipelineSize):
         """
         Set the number of outstanding interests which this maintains while
-        fetching segments.
+        fetching segments. If this is called while fetching and the size
+        increases, this immediately requests more segments to fill the pipeline.
 
         :param int interestPipelineSize: The Interest pipeline size.
         :raises RuntimeError: If interestPipelineSize is less than 1.
         """
         if interestPipelineSize < 1:
             raise RuntimeError("The interestPipelineSize must be at least 1")
+        previousInterestPipelineSize = self._interestPipelineSize
         self._interestPipelineSize = interestPipelineSize
 
+        if (self._isFetching and
+            interestPipelineSize > previousInterestPipelineSize):
+            # Don't wait for the next segment to use the larger pipeline.
+            self._requestNewSegments(interestPipelineSize)
+
     def getInitialInterestCount(self):
         """
         Get the initial Interest count (as described in setInitialInterestCount).
@@ -291,22 +302,32 @@ class SegmentStreamHandler(Namespace.Handler):
         return True
 
     def _onStateChanged(self, namespace, changedNamespace, state, callbackId):
+        # This is called for every state change in the subtree, so first do the
+        # cheap checks. A node is an immediate child if its parent is our node.
+        if (state == NamespaceState.INTEREST_TIMEOUT or
+            state == NamespaceState.INTEREST_NETWORK_NACK):
+            if (changedNamespace.parent == self.namespace and
+                changedNamespace.name[-1].isSegment()):
+                # Fetching has stalled, so don't let setInterestPipelineSize
+                # request more segments until they are requested again.
+                self._isFetching = False
+            return
+
         if not (state == NamespaceState.OBJECT_READY and
-                len(changedNamespace.name) == len(self.namespace.name) + 1 and
+                changedNamespace.parent == self.namespace and
                 changedNamespace.name[-1].isSegment()):
             # Not a segment, ignore.
             return
 
-        metaInfo = changedNamespace.data.metaInfo
-        if (metaInfo.getFinalBlockId().getValue().size() > 0 and
-             metaInfo.getFinalBlockId().isSegment()):
-            self._finalSegmentNumber = metaInfo.getFinalBlockId().toSegment()
+        finalBlockId = changedNamespace.data.metaInfo.getFinalBlockId()
+        if finalBlockId.getValue().size() > 0 and finalBlockId.isSegment():
+            self._finalSegmentNumber = finalBlockId.toSegment()
 
         # Report as many segments as possible where the node already has content.
         while True:
             nextSegmentNumber = self._maxReportedSegmentNumber + 1
-            nextSegment = self.namespace[
-              Name.Component.fromSegment(nextSegmentNumber)]
+            nextSegment = self.namespace._getChild(
+              Name.Component.fromSegment(nextSegmentNumber))
             if nextSegment.getObject() == None:
                 break
 
@@ -324,6 +345,7 @@ class SegmentStreamHandler(Namespace.Handler):
             if (self._finalSegmentNumber != None and
                 nextSegmentNumber == self._finalSegmentNumber):
                 # Finished.
+                self._isFetching = False
                 self._fireOnSegment(None)
 
                 # Free resources that won't be used anymore.
@@ -338,16 +360,29 @@ class SegmentStreamHandler(Namespace.Handler):
     def _requestNewSegments(self, maxRequestedSegments):
         if maxRequestedSegments < 1:
             maxRequestedSegments = 1
-
-        childComponents = self.namespace.getChildComponents()
-        # First, count how many are already requested and not received.
+        # Set this here since fetching may start with objectNeeded for a segment
+        # child (as in GeneralizedObjectHandler) instead of for our node.
+        self._isFetching = True
+
+        # This loop doesn't add children, so use the internal sorted list
+        # instead of the copy from getChildComponents.
+        childComponents = self.namespace._getSortedChildrenKeys()
+        if childComponents == None:
+            childComponents = []
+        # First, count how many are already requested and not received. Segments
+        # up to _maxReportedSegmentNumber have been received, so only check the
+        # children after them in the sorted order instead of every child.
         nRequestedSegments = 0
-        for component in childComponents:
+        startIndex = bisect.bisect_left(
+          childComponents,
+          Name.Component.fromSegment(self._maxReportedSegmentNumber + 1))
+        for i in range(startIndex, len(childComponents)):
+            component = childComponents[i]
             if not component.isSegment():
                 # The namespace contains a child other than a segment. Ignore.
                 continue
 
-            child = self.namespace[component]
+            child = self.namespace._getChild(component)
             if (child.data == None and
                 child.state >= NamespaceState.INTEREST_EXPRESSED):
                 nRequestedSegments += 1
@@ -363,7 +398,8 @@ class SegmentStreamHandler(Namespace.Handler):
                 segmentNumber > self._finalSegmentNumber):
                 break
 
-            segment = self.namespace[Name.Component.fromSegment(segmentNumber)]
+            segment = self.namespace._getChild(
+              Name.Component.fromSegment(segmentNumber))
             if (segment.data != None or
                 segment.state >= NamespaceState.INTEREST_EXPRESSED):
                 # Already got the data packet or already requested.
@@ -373,12 +409,12 @@ class SegmentStreamHandler(Namespace.Handler):
             segment.objectNeeded()
 
     def _fireOnSegment(self, segmentNamespace):
-        # Copy the keys before iterating since callbacks can change the list.
-        for id in list(self._onSegmentCallbacks.keys()):
+        # Copy the items before iterating since callbacks can change the list.
+        for id, onSegment in list(self._onSegmentCallbacks.items()):
             # A callback on a previous pass may have removed this callback, so check.
-            if id in self._onSegmentCallbacks.keys():
+            if id in self._onSegmentCallbacks:
                 try:
-                    self._onSegmentCallbacks[id](segmentNamespace)
+                    onSegment(segmentNamespace)
                 except:
                     logging.exception("Error in onSegment")
 